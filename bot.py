@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 
+import argparse
 import requests
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import json
 import os
-import pytz
+import random
 import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson as jsonlib
+except ImportError:  # stdlib json also accepts bytes in loads()
+    import json as jsonlib
 
 # ===== CONFIG =====
 
@@ -18,6 +26,59 @@ RSI_OVERBOUGHT = 70
 RSI_OVERSOLD = 30
 EMA_FAST = 12
 EMA_SLOW = 26
+CACHE_DIR = os.getenv('BTC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'btc-trading-bot'))
+CACHE_TTL = 3600  # seconds; daily candles only change once a day
+CACHE_MAX_AGE = 24 * 3600  # seconds; older cached data is not used even if the refresh fails
+MAX_RETRIES = 3
+THAILAND_TZ = timezone(timedelta(hours=7))  # Asia/Bangkok has no DST
+
+class JitterRetry(Retry):
+    """Retry ที่สุ่ม backoff ±50% เพื่อไม่ให้ retry ชนกันพร้อมกัน"""
+
+    def get_backoff_time(self):
+        return super().get_backoff_time() * random.uniform(0.5, 1.5)
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        new_retry = super().increment(method, url, response, error, *args, **kwargs)
+        # url is not logged: the Telegram path contains the bot token
+        cause = error if error is not None else f"HTTP {response.status}"
+        attempt = len(new_retry.history)
+        budget = attempt + new_retry.total  # total counts down once per retry
+        print(f"⏳ {method} retry {attempt}/{budget} after: {cause}")
+        return new_retry
+
+def make_session(retries=MAX_RETRIES):
+    """สร้าง requests.Session ที่ retry ด้วย exponential backoff + jitter
+
+    GET (CoinGecko) retries 429/5xx and timeouts. Telegram's POST retries only
+    connection failures and 429: after a read timeout or 5xx the message may
+    already be delivered, so re-sending would duplicate the alert.
+    """
+    get_retry = JitterRetry(
+        total=retries,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    post_retry = JitterRetry(
+        total=retries,
+        read=0,
+        other=0,
+        backoff_factor=0.5,
+        status_forcelist=(429,),
+        allowed_methods=frozenset({'POST'}),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=get_retry))
+    session.mount('https://api.telegram.org/', HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=post_retry))
+    return session
+
+# Shared across calls so Telegram / CoinGecko reuse keep-alive connections
+SESSION = make_session()
 
 def send_telegram_message(msg):
     """ส่ง Message ไป Telegram"""
@@ -28,7 +89,7 @@ def send_telegram_message(msg):
         'parse_mode': 'Markdown'
     }
     try:
-        response = requests.post(url, data=data, timeout=10)
+        response = SESSION.post(url, data=data, timeout=10)
         if response.status_code == 200:
             print(f"✅ Message sent at {datetime.now().strftime('%H:%M:%S')}")
             return True
@@ -39,85 +100,140 @@ def send_telegram_message(msg):
         print(f"❌ Connection error: {e}")
         return False
 
-def get_btc_data(max_retries=3, timeout=15):
-    """ดึงข้อมูล BTC จาก CoinGecko with timeout and retry"""
-    for attempt in range(max_retries):
-        try:
-            url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=365&interval=daily"
-            headers = {'User-Agent': 'Mozilla/5.0'}
-            print(f"📡 Fetching BTC data (attempt {attempt+1}/{max_retries})...")
-            start_time = datetime.now()
-            response = requests.get(url, headers=headers, timeout=timeout)
-            if response.status_code != 200:
-                raise Exception(f"API status {response.status_code}")
-            data = response.json()
-            prices = data['prices']
-            df = pd.DataFrame({
-                'timestamp': [datetime.fromtimestamp(p[0]/1000) for p in prices],
-                'close': [p[1] for p in prices]
-            })
-            df['open'] = df['close'].shift(1).fillna(df['close'])
-            df['high'] = df['close'].rolling(window=2, min_periods=1).max()
-            df['low'] = df['close'].rolling(window=2, min_periods=1).min()
-            elapsed = (datetime.now() - start_time).total_seconds()
-            print(f"✅ Got {len(df)} candles in {elapsed:.1f}s")
-            return df.reset_index(drop=True)
-        except requests.Timeout:
-            print(f"⚠️ Timeout on attempt {attempt+1}")
-            if attempt < max_retries - 1:
-                print(f"⏳ Retrying in 5 seconds...")
-                time.sleep(5)
-            else:
-                print(f"❌ Failed after {max_retries} attempts")
-                return None
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            if attempt < max_retries - 1:
-                print(f"⏳ Retrying in 5 seconds...")
-                time.sleep(5)
+def load_cache():
+    """โหลดข้อมูล BTC ที่ cache ไว้บน disk (None ถ้าไม่มีหรืออ่านไม่ได้)"""
+    try:
+        with open(os.path.join(CACHE_DIR, 'meta.json')) as f:
+            meta = json.load(f)
+        return {
+            'close': np.load(os.path.join(CACHE_DIR, 'close.npy'), allow_pickle=False),
+            'etag': meta.get('etag'),
+            'last_modified': meta.get('last_modified'),
+            'saved_at': float(meta['saved_at'])
+        }
+    except Exception:
+        return None
+
+def save_cache(close, etag=None, last_modified=None):
+    """บันทึกราคาปิด (close.npy) พร้อม ETag / Last-Modified (meta.json) ลง disk"""
+    meta = {
+        'etag': etag,
+        'last_modified': last_modified,
+        'saved_at': time.time()
+    }
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        np.save(os.path.join(CACHE_DIR, 'close.npy'), close, allow_pickle=False)
+        with open(os.path.join(CACHE_DIR, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    except OSError as e:
+        print(f"⚠️ Could not write cache: {e}")
+
+def get_btc_data(timeout=15):
+    """ดึงราคาปิด BTC จาก CoinGecko with timeout, retry and disk cache
+
+    Returns (close, fetched_at): close is an np.ndarray and fetched_at is the
+    time.time() at which it was last confirmed current, or (None, None).
+    """
+    cache = load_cache()
+    if cache is not None and time.time() - cache['saved_at'] < CACHE_TTL:
+        print(f"💾 Using cached BTC data ({len(cache['close'])} candles)")
+        return cache['close'], cache['saved_at']
+
+    url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=365&interval=daily"
+    headers = {}
+    if cache is not None:
+        if cache['etag']:
+            headers['If-None-Match'] = cache['etag']
+        if cache['last_modified']:
+            headers['If-Modified-Since'] = cache['last_modified']
+    try:
+        print(f"📡 Fetching BTC data (up to {MAX_RETRIES} retries)...")
+        start_time = datetime.now()
+        response = SESSION.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cache is not None:
+            save_cache(cache['close'],
+                       response.headers.get('ETag', cache['etag']),
+                       response.headers.get('Last-Modified', cache['last_modified']))
+            print(f"💾 Not modified, using cached BTC data ({len(cache['close'])} candles)")
+            return cache['close'], time.time()
+        if response.status_code != 200:
+            raise Exception(f"API status {response.status_code}")
+        data = jsonlib.loads(response.content)
+        prices = np.asarray(data['prices'], dtype=np.float64)
+        close = np.ascontiguousarray(prices[:, 1])
+        save_cache(close, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        elapsed = (datetime.now() - start_time).total_seconds()
+        print(f"✅ Got {len(close)} candles in {elapsed:.1f}s")
+        return close, time.time()
+    except Exception as e:
+        # Exhausted retries surface as ConnectionError wrapping MaxRetryError
+        reason = None
+        if isinstance(e, requests.ConnectionError) and e.args:
+            reason = getattr(e.args[0], 'reason', None)
+        print(f"❌ Error: {reason or e}")
+
+    if cache is not None:
+        age = time.time() - cache['saved_at']
+        if age < CACHE_MAX_AGE:
+            print(f"⚠️ Refresh failed, using stale cached BTC data ({age / 3600:.1f}h old)")
+            return cache['close'], cache['saved_at']
+        print(f"❌ Cached BTC data is {age / 3600:.1f}h old, not using it")
+    return None, None
+
+def _fused_indicators(close, rsi_period, fast, slow):
+    """RSI (Wilder) + EMA fast/slow in one pass over close
+
+    Only the last two samples are used, so only those are returned:
+    (rsi_prev, rsi_last, ema_fast_prev, ema_fast_last, ema_slow_prev, ema_slow_last)
+    """
+    n = len(close)
+    seed = np.diff(close[:rsi_period+2])
+    inv_period = 1.0/rsi_period
+    alpha = (rsi_period-1)*inv_period
+    up = np.maximum(seed, 0.).sum()*inv_period
+    down = -np.minimum(seed, 0.).sum()*inv_period
+    rs = up/down if down != 0 else 0.
+    rsi = 100. - 100./(1. + rs)
+    rsi_prev = rsi
+
+    k_fast = 2.0/(fast + 1.0)
+    k_slow = 2.0/(slow + 1.0)
+    ema_f = close[0]
+    ema_s = close[0]
+    ema_f_prev = ema_f
+    ema_s_prev = ema_s
+
+    for i in range(1, n):
+        price = close[i]
+        ema_f_prev = ema_f
+        ema_s_prev = ema_s
+        rsi_prev = rsi
+        ema_f += k_fast*(price - ema_f)
+        ema_s += k_slow*(price - ema_s)
+
+        if i >= rsi_period:
+            delta = price - close[i-1]
+            if delta>0:
+                upval = delta
+                downval = 0.
             else:
-                return None
-
-def calculate_rsi(prices, period=14):
-    """Calculate RSI using NumPy"""
-    deltas = np.diff(prices)
-    seed = deltas[:period+1]
-    up = seed[seed>=0].sum()/period
-    down = -seed[seed<0].sum()/period
-    rs = up/down if down != 0 else 0
-    rsi = np.zeros_like(prices)
-    rsi[:period] = 100. - 100./(1. + rs)
-
-    for i in range(period, len(prices)):
-        delta = deltas[i-1]
-        if delta>0:
-            upval = delta
-            downval = 0.
-        else:
-            upval = 0.
-            downval = -delta
-        up = (up*(period-1) + upval)/period
-        down = (down*(period-1) + downval)/period
-        rs = up/down if down != 0 else 0
-        rsi[i] = 100. - 100./(1. + rs)
-    return rsi
-
-def calculate_ema(prices, period):
-    """Calculate EMA using NumPy"""
-    ema = np.zeros_like(prices, dtype=float)
-    ema[0] = prices[0]
-    multiplier = 2.0 / (period + 1.0)
-    for i in range(1, len(prices)):
-        ema[i] = prices[i] * multiplier + ema[i-1] * (1 - multiplier)
-    return ema
+                upval = 0.
+                downval = -delta
+            up = up*alpha + upval*inv_period
+            down = down*alpha + downval*inv_period
+            rs = up/down if down != 0 else 0.
+            rsi = 100. - 100./(1. + rs)
+    return rsi_prev, rsi, ema_f_prev, ema_f, ema_s_prev, ema_s
+
+def calculate_indicators(close):
+    """Calculate RSI, EMA fast and EMA slow in one fused pass"""
+    close = np.asarray(close, dtype=np.float64)
+    return _fused_indicators(close, RSI_PERIOD, EMA_FAST, EMA_SLOW)
 
 def get_thailand_time():
     """ดึงเวลา Thailand (UTC+7)"""
-    utc_tz = pytz.UTC
-    thailand_tz = pytz.timezone('Asia/Bangkok')
-    utc_time = datetime.now(utc_tz)
-    thailand_time = utc_time.astimezone(thailand_tz)
-    return thailand_time
+    return datetime.now(THAILAND_TZ)
 
 def send_heartbeat():
     """ส่ง Heartbeat status ทุก 5 นาที"""
@@ -139,27 +255,15 @@ def analyze_market():
         thailand_time = get_thailand_time()
         timestamp = thailand_time.strftime('%Y-%m-%d %H:%M:%S')
         print(f"\n🔍 [{timestamp}] Analyzing BTC...")
-        df = get_btc_data()
-        if df is None or len(df) == 0:
+        close, fetched_at = get_btc_data()
+        if close is None or len(close) == 0:
             raise Exception("No data")
+        data_age = time.time() - fetched_at
 
-        df['rsi'] = calculate_rsi(df['close'].values, RSI_PERIOD)
-        df['ema_fast'] = calculate_ema(df['close'].values, EMA_FAST)
-        df['ema_slow'] = calculate_ema(df['close'].values, EMA_SLOW)
-
-        df_clean = df.dropna(subset=['rsi', 'ema_fast', 'ema_slow']).copy()
-        if len(df_clean) == 0:
-            raise Exception("No valid data")
-
-        last_row = df_clean.iloc[-1]
-        prev_row = df_clean.iloc[-2] if len(df_clean) > 1 else last_row
-
-        last_rsi = float(last_row['rsi'])
-        last_price = float(last_row['close'])
-        ema_fast_last = float(last_row['ema_fast'])
-        ema_slow_last = float(last_row['ema_slow'])
-        ema_fast_prev = float(prev_row['ema_fast'])
-        ema_slow_prev = float(prev_row['ema_slow'])
+        (_, last_rsi,
+         ema_fast_prev, ema_fast_last,
+         ema_slow_prev, ema_slow_last) = calculate_indicators(close)
+        last_price = float(close[-1])
 
         print(f"📊 BTC: ${last_price:,.2f} | RSI: {last_rsi:.2f}")
         print(f"📈 EMA {EMA_FAST}: {ema_fast_last:.2f} | EMA {EMA_SLOW}: {ema_slow_last:.2f}")
@@ -171,22 +275,29 @@ def analyze_market():
         elif last_rsi <= RSI_OVERSOLD:
             alerts.append(f"🥶 *RSI OVERSOLD!* ({last_rsi:.2f})")
 
-        if ema_fast_prev <= ema_slow_prev and ema_fast_last > ema_slow_last:
+        d_prev = ema_fast_prev - ema_slow_prev
+        d_last = ema_fast_last - ema_slow_last
+        if d_prev <= 0 < d_last:
             alerts.append(f"✨ *GOLDEN CROSS!* EMA {EMA_FAST} > EMA {EMA_SLOW}")
-        if ema_fast_prev >= ema_slow_prev and ema_fast_last < ema_slow_last:
+        if d_prev >= 0 > d_last:
             alerts.append(f"💀 *DEATH CROSS!* EMA {EMA_FAST} < EMA {EMA_SLOW}")
 
         if alerts:
             print(f"🚨 Found {len(alerts)} alert(s)!")
-            alert_msg = f"🚨 *TRADING ALERT!*\n\n"
-            for i, alert in enumerate(alerts, 1):
-                alert_msg += f"{i}. {alert}\n"
-            alert_msg += f"\n📊 *Market Data:*\n"
-            alert_msg += f"Price: `${last_price:,.2f}`\n"
-            alert_msg += f"RSI(14): `{last_rsi:.2f}`\n"
-            alert_msg += f"EMA {EMA_FAST}: `{ema_fast_last:.2f}`\n"
-            alert_msg += f"EMA {EMA_SLOW}: `{ema_slow_last:.2f}`\n"
-            alert_msg += f"Time: `{timestamp}`"
+            parts = ["🚨 *TRADING ALERT!*", ""]
+            parts.extend(f"{i}. {alert}" for i, alert in enumerate(alerts, 1))
+            parts += [
+                "",
+                "📊 *Market Data:*",
+                f"Price: `${last_price:,.2f}`",
+                f"RSI(14): `{last_rsi:.2f}`",
+                f"EMA {EMA_FAST}: `{ema_fast_last:.2f}`",
+                f"EMA {EMA_SLOW}: `{ema_slow_last:.2f}`",
+                f"Time: `{timestamp}`"
+            ]
+            if data_age >= CACHE_TTL:
+                parts.append(f"⚠️ Data age: `{data_age / 3600:.1f}h` (CoinGecko refresh failed)")
+            alert_msg = "\n".join(parts)
             send_telegram_message(alert_msg)
             print("🚨 ALERT SENT!")
         else:
@@ -194,8 +305,20 @@ def analyze_market():
     except Exception as e:
         print(f"❌ Error: {type(e).__name__}: {e}")
         send_telegram_message(f"⚠️ *Bot Error!*\n`{type(e).__name__}`: {str(e)[:150]}")
-if __name__ == "__main__":
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BTC Trading Bot")
+    parser.add_argument('--mode', choices=('analyze', 'heartbeat'), default='analyze',
+                        help="analyze: check RSI/EMA and alert; heartbeat: send a status ping")
+    args = parser.parse_args(argv)
+
     print("=" * 70)
     print("🤖 BTC Trading Bot - GitHub Actions Version (Optimized)")
     print("=" * 70)
-    analyze_market()
+    if args.mode == 'heartbeat':
+        send_heartbeat()
+    else:
+        analyze_market()
+
+if __name__ == "__main__":
+    main()